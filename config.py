@@ -7,12 +7,37 @@ from typing import Dict
 load_dotenv()
 
 MAX_FEE = 251222419383266
+# Each source is queried with the maximal page size the venue allows.
 SOURCE_DATA = {
-    1: 'https://data-api.binance.vision/api/v3/aggTrades?symbol=ETHUSDC',
-    2: 'https://data-api.binance.vision/api/v3/aggTrades?symbol=STRKUSDC',
-    3: 'https://data-api.binance.vision/api/v3/aggTrades?symbol=BTCUSDC'
+    1: {
+        'binance': 'https://data-api.binance.vision/api/v3/aggTrades?symbol=ETHUSDC&limit=1000',
+        'bybit': 'https://api.bybit.com/v5/market/recent-trade?category=spot&symbol=ETHUSDC&limit=60',
+        'okx': 'https://www.okx.com/api/v5/market/trades?instId=ETH-USDC&limit=500',
+    },
+    2: {
+        'binance': 'https://data-api.binance.vision/api/v3/aggTrades?symbol=STRKUSDC&limit=1000',
+        'bybit': 'https://api.bybit.com/v5/market/recent-trade?category=spot&symbol=STRKUSDC&limit=60',
+        'okx': 'https://www.okx.com/api/v5/market/trades?instId=STRK-USDC&limit=500',
+    },
+    3: {
+        'binance': 'https://data-api.binance.vision/api/v3/aggTrades?symbol=BTCUSDC&limit=1000',
+        'bybit': 'https://api.bybit.com/v5/market/recent-trade?category=spot&symbol=BTCUSDC&limit=60',
+        'okx': 'https://www.okx.com/api/v5/market/trades?instId=BTC-USDC&limit=500',
+    },
 }
+SOURCE_TIMEOUT_SECONDS = 2 # deadline for querying all sources of a market
+SOURCE_MAX_AGE_SECONDS = 60 # source whose last trade is older is considered stale
+SOURCE_MAX_DEVIATION = 0.005 # source further from the median of sources is considered an outlier
+SOURCE_MIN_SOURCES = 1 # do not requote if fewer sources are valid
+SOURCE_MARKET_CFG = { # per market overrides of SOURCE_MAX_AGE_SECONDS and SOURCE_MIN_SOURCES
+    1: {'max_age': 60, 'min_sources': 2}, # ETH/USDC, liquid on all venues
+    2: {'max_age': 300, 'min_sources': 1}, # STRK/USDC trades rarely on Bybit/OKX, Binance alone is enough
+    3: {'max_age': 120, 'min_sources': 2}, # wBTC/USDC
+}
+SOURCE_AGGREGATION = 'median' # 'median' or 'vwap'
+MAX_SKIPPED_REQUOTING_CYCLES = 5 # cancel the market's orders after this many cycles without a reliable price
 SLEEPER_SECONDS_BETWEEN_REQUOTING = 5
+ORDER_BOOK_LOG_INTERVAL_SECONDS = 60 # current orders are logged at most this often per market
 
 @dataclass
 class Config:
@@ -0,0 +1,105 @@
+from contextvars import ContextVar
+from logging.handlers import QueueHandler, QueueListener
+from typing import Dict, Hashable, List, Optional
+import copy
+import json
+import logging
+import queue
+import time
+
+# Set by the main loop, picked up by every record logged within the current task/thread.
+market_id_var: ContextVar[Optional[int]] = ContextVar("market_id", default=None)
+cycle_id_var: ContextVar[Optional[int]] = ContextVar("cycle_id", default=None)
+
+
+class ContextFilter(logging.Filter):
+    """Attaches the current market and cycle IDs to every record."""
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        record.market_id = market_id_var.get()
+        record.cycle_id = cycle_id_var.get()
+        return True
+
+
+# Attributes every LogRecord has, anything else was passed through `extra`.
+_RECORD_ATTRIBUTES = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime"}
+
+
+class JsonFormatter(logging.Formatter):
+    """Formats records as single-line JSON objects, fields passed through `extra` included."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "time": self.formatTime(record),
+            "level": record.levelname,
+            "logger": record.name,
+            "market_id": getattr(record, "market_id", None),
+            "cycle_id": getattr(record, "cycle_id", None),
+            "message": record.getMessage(),
+        }
+        for key, value in vars(record).items():
+            if key not in _RECORD_ATTRIBUTES and key not in entry:
+                entry[key] = value
+        if record.exc_info:
+            entry["exc_info"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+def _is_immutable(value) -> bool:
+    if isinstance(value, tuple):
+        return all(_is_immutable(x) for x in value)
+    return value is None or isinstance(value, (str, bytes, int, float, complex))
+
+
+class LazyQueueHandler(QueueHandler):
+    """
+    QueueHandler which leaves message formatting to the listener thread where it is safe.
+
+    Records whose arguments are all immutable are enqueued as is and formatted by the listener.
+    Any other record (e.g. logging an order list) has its message rendered here, so that later
+    mutations of the arguments do not show up in the log.
+    """
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        if isinstance(record.msg, str) and _is_immutable(record.args):
+            return record
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+
+
+class RateLimiter:
+    """Allows an action at most once per `interval` seconds for each key."""
+
+    def __init__(self, interval: float) -> None:
+        self.interval = interval
+        self.last: Dict[Hashable, float] = {}
+
+    def allow(self, key: Hashable) -> bool:
+        now = time.monotonic()
+        if now - self.last.get(key, float("-inf")) < self.interval:
+            return False
+        self.last[key] = now
+        return True
+
+
+def setup_queue_logging(level: int, handlers: List[logging.Handler]) -> QueueListener:
+    """
+    Routes all records of the root logger through a queue to `handlers` running in a background thread.
+
+    Returns the started listener, which should be stopped on exit to flush the remaining records.
+    """
+    log_queue = queue.SimpleQueue()
+    queue_handler = LazyQueueHandler(log_queue)
+    queue_handler.addFilter(ContextFilter())
+
+    root = logging.getLogger()
+    root.setLevel(level)
+    for handler in root.handlers[:]:
+        root.removeHandler(handler)
+    root.addHandler(queue_handler)
+
+    listener = QueueListener(log_queue, *handlers, respect_handler_level=True)
+    listener.start()
+    return listener
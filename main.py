@@ -1,10 +1,12 @@
 from typing import Any, Tuple
 import argparse
 import asyncio
+import atexit
 import logging
-import requests
 import sys
 from remus import RemusManager
+from logs import JsonFormatter, RateLimiter, setup_queue_logging, market_id_var, cycle_id_var
+from source import SourceManager
 
 from starknet_py.net.full_node_client import FullNodeClient
 # from starknet_py.hash.selector import get_selector_from_name
@@ -18,14 +20,38 @@ from starknet_py.transaction_errors import TransactionNotReceivedError
 # from starknet_py.utils.typed_data import EnumParameter
 # from starknet_py.net.client_models import ResourceBounds
 
-from config import token_config, env_config, market_config, MAX_FEE, SOURCE_DATA, SLEEPER_SECONDS_BETWEEN_REQUOTING
+from config import (
+    token_config, env_config, market_config, MAX_FEE, SOURCE_DATA, SLEEPER_SECONDS_BETWEEN_REQUOTING,
+    SOURCE_TIMEOUT_SECONDS, SOURCE_MAX_AGE_SECONDS, SOURCE_MAX_DEVIATION, SOURCE_MIN_SOURCES, SOURCE_AGGREGATION,
+    SOURCE_MARKET_CFG, MAX_SKIPPED_REQUOTING_CYCLES, ORDER_BOOK_LOG_INTERVAL_SECONDS
+)
 
 
 
-def setup_logging(log_level: str):
-    """Configures logging for the application."""
-    log_format = "%(asctime)s - %(levelname)s - %(message)s"
-    logging.basicConfig(level=getattr(logging, log_level.upper(), "INFO"), format=log_format)
+# Only set in structured mode, plain mode logs the orders every cycle.
+order_book_log_limiter = None
+
+
+def setup_logging(log_level: str, structured: bool = False):
+    """
+    Configures logging for the application.
+
+    In structured mode records are emitted as JSON (with market and cycle IDs) by a background
+    thread, so that formatting and I/O happen outside of the event loop. The order dumps are then
+    also rate limited to one per ORDER_BOOK_LOG_INTERVAL_SECONDS for each market.
+    """
+    global order_book_log_limiter
+    level = getattr(logging, log_level.upper(), logging.INFO)
+    if not structured:
+        log_format = "%(asctime)s - %(levelname)s - %(message)s"
+        logging.basicConfig(level=level, format=log_format)
+        return
+
+    handler = logging.StreamHandler()
+    handler.setFormatter(JsonFormatter())
+    listener = setup_queue_logging(level, [handler])
+    atexit.register(listener.stop)
+    order_book_log_limiter = RateLimiter(ORDER_BOOK_LOG_INTERVAL_SECONDS)
 
     
 def parse_arguments():
@@ -38,6 +64,11 @@ def parse_arguments():
         choices = ["DEBUG", "INFO", "WARNING", "ERROR", "CRITICAL"],
         help = "Set the logging level"
     )
+    parser.add_argument(
+        "--structured-logging",
+        action = "store_true",
+        help = "Emit JSON logs from a background thread"
+    )
     return parser.parse_args()
 
 
@@ -59,7 +90,7 @@ def get_market_cfg(all_remus_cfgs: Any, market_id: int) -> Tuple[Any, Any]:
     assert market_maker_cfg
     market_cfg = [x for x in all_remus_cfgs[0] if x[0] == market_id][0]
     assert market_cfg
-    logging.info(f"Succesfully loaded market configs for market_id={market_id}.")
+    logging.info("Succesfully loaded market configs for market_id=%s.", market_id)
     return market_cfg, market_maker_cfg
 
 
@@ -75,15 +106,15 @@ async def claim_tokens(market_cfg, remus_contract) -> None:
             token_address = token_address,
             user_address = env_config.wallet_address
         )
-        logging.info(f'Claimable amount is {claimable} for token {hex(token_address)}.')
+        logging.info('Claimable amount is %s for token %s.', claimable, hex(token_address))
         if claimable[0]:
-            logging.info(f'Claiming')
+            logging.info('Claiming')
             claim = await remus_contract.functions['claim'].invoke_v1(
                 token_address = token_address,
                 amount = claimable[0],
                 max_fee = MAX_FEE
             )
-        logging.info(f'Claim done.')
+        logging.info('Claim done.')
 
 
 async def get_position(market_cfg, account, asks, bids, base_token_contract, quote_token_contract):
@@ -100,8 +131,10 @@ async def get_position(market_cfg, account, asks, bids, base_token_contract, quo
     amount_remaining_quote = sum(x['amount_remaining'] for x in bids)
     total_possible_position_quote = balance_quote[0] + amount_remaining_quote
 
-    logging.debug(f"Queried user balance for market_id: {market_cfg[0]} as ({total_possible_position_base}, {total_possible_position_quote})")
-    logging.debug(f"Queried user balance for market_id: {market_cfg[0]}")
+    logging.debug(
+        "Queried user balance for market_id: %s as (%s, %s)",
+        market_cfg[0], total_possible_position_base, total_possible_position_quote
+    )
 
     return total_possible_position_base, total_possible_position_quote
 
@@ -129,8 +162,8 @@ def get_optimal_quotes(asks, bids, market_maker_cfg, market_cfg, fair_price):
         for order in side:
             # If the remaining order size is too small requote (cancel order)
             if order['amount_remaining'] / 10**base_decimals * order['price'] / 10**base_decimals < market_maker_cfg['minimal_remaining_quote_size']:
-                logging.info(f"Canceling order because of insufficient amount. amount: {order['amount_remaining']}")
-                logging.debug(f"Canceling order because of insufficient amount. order: {order}")
+                logging.info("Canceling order because of insufficient amount. amount: %s", order['amount_remaining'])
+                logging.debug("Canceling order because of insufficient amount. order: %s", order)
                 to_be_canceled_side.append(order)
                 continue
             if (
@@ -146,8 +179,8 @@ def get_optimal_quotes(asks, bids, market_maker_cfg, market_cfg, fair_price):
                     (order['price'] / 10**base_decimals < (1 + market_maker_cfg['min_relative_distance_from_FP']) * fair_price)
                 )
             ):
-                logging.info(f"Canceling order because too close to FP. fair_price: {fair_price}, order price: {order['price'] / 10**base_decimals}")
-                logging.debug(f"Canceling order because too close to FP. order: {order}")
+                logging.info("Canceling order because too close to FP. fair_price: %s, order price: %s", fair_price, order['price'] / 10**base_decimals)
+                logging.debug("Canceling order because too close to FP. order: %s", order)
                 to_be_canceled_side.append(order)
         # If there is too many orders in the market that are not being canceled, cancel those with the most distant price from FP
         # to a point that only the "allowed" number of orders is being kept.
@@ -196,8 +229,8 @@ def get_optimal_quotes(asks, bids, market_maker_cfg, market_cfg, fair_price):
                 'price': optimal_price
             }
             to_be_created.append(order)
-    logging.info(f"Optimal quotes calculated: to_be_canceled: {len(to_be_canceled)}, to_be_created: {len(to_be_created)}")
-    logging.debug(f"Optimal quotes calculated: to_be_canceled: {to_be_canceled}, to_be_created: {to_be_created}")
+    logging.info("Optimal quotes calculated: to_be_canceled: %s, to_be_created: %s", len(to_be_canceled), len(to_be_created))
+    logging.debug("Optimal quotes calculated: to_be_canceled: %s, to_be_created: %s", to_be_canceled, to_be_created)
     return to_be_canceled, to_be_created
 
 
@@ -218,7 +251,7 @@ async def update_delete_quotes(
             max_fee=MAX_FEE,
             nonce = nonce + i
         )
-        logging.info(f"Canceling: {order['maker_order_id']}")
+        logging.info("Canceling: %s", order['maker_order_id'])
         number_of_txs_used += 1
 
     return nonce + number_of_txs_used
@@ -255,20 +288,21 @@ async def update_best_quotes(
             max_fee = MAX_FEE,
             nonce = nonce + i * 2
         )
-        logging.info(f"Approving: {approve_amount}")
+        logging.info("Approving: %s", approve_amount)
 
         logging.info("Soon to sumbit order: q: %s, p: %s, s: %s", order['amount'], order['price'], order_side)
-        logging.debug("Soon to sumbit order: %s", dict(
-            market_id = market_id,
-            target_token_address = target_token_address,
-            order_price = order['price'],
-            order_size = order['amount'],
-            order_side = (order_side, None),
-            order_type = ('Basic', None),
-            time_limit = ('GTC', None),
-            max_fee = MAX_FEE,
-            nonce = nonce + i * 2 + 1
-        ))
+        if logging.getLogger().isEnabledFor(logging.DEBUG):
+            logging.debug("Soon to sumbit order: %s", dict(
+                market_id = market_id,
+                target_token_address = target_token_address,
+                order_price = order['price'],
+                order_size = order['amount'],
+                order_side = (order_side, None),
+                order_type = ('Basic', None),
+                time_limit = ('GTC', None),
+                max_fee = MAX_FEE,
+                nonce = nonce + i * 2 + 1
+            ))
         await remus_contract.functions['submit_maker_order'].invoke_v1(
             market_id = market_id,
             target_token_address = target_token_address,
@@ -280,11 +314,35 @@ async def update_best_quotes(
             max_fee = MAX_FEE,
             nonce = nonce + i * 2 + 1
         )
-        logging.info(f"Submitting order: q: {order['amount']}, p: {order['price']}, s: {order_side}")
+        logging.info("Submitting order: q: %s, p: %s, s: %s", order['amount'], order['price'], order_side)
     logging.info('Done with order changes')
 
 
-def pretty_print_orders(asks, bids):
+def order_fields(order):
+    return {
+        'maker_order_id': order['maker_order_id'],
+        'price': order['price'] / 10**18,
+        'amount_remaining': order['amount_remaining'] / 10**18
+    }
+
+
+def pretty_print_orders(market_id, asks, bids):
+    """
+    Logs the current orders.
+
+    In structured logging mode this is a single record with the orders in its `asks` and `bids`
+    fields, rate limited for each market. Otherwise one line per order is logged every cycle.
+    """
+    if not logging.getLogger().isEnabledFor(logging.INFO):
+        return
+    if order_book_log_limiter is not None:
+        if order_book_log_limiter.allow(market_id):
+            # The lists are built here and never touched again, so they can be formatted later.
+            logging.info('Current orders.', extra={
+                'asks': [order_fields(x) for x in sorted(asks, key=lambda x: -x['price'])],
+                'bids': [order_fields(x) for x in sorted(bids, key=lambda x: -x['price'])]
+            })
+        return
     logging.info('Pretty printed current orders.')
     for ask in sorted(asks, key=lambda x: -x['price']):
         logging.info('\t\t%s; %s', ask['price'] / 10**18, ask['amount_remaining'] / 10**18)
@@ -296,7 +354,7 @@ def pretty_print_orders(asks, bids):
 async def async_main():
     """Main async execution function."""
     args = parse_arguments()
-    setup_logging(args.log_level)
+    setup_logging(args.log_level, args.structured_logging)
 
     logging.info("Starting Simple Stupid Market Maker")
 
@@ -310,10 +368,25 @@ async def async_main():
     all_remus_cfgs = await remus_contract.functions['get_all_market_configs'].call()
 
     # remus_manager = RemusManager(account, env_config, remus_contract, all_remus_cfgs)
+    source_manager = SourceManager(
+        SOURCE_DATA,
+        timeout = SOURCE_TIMEOUT_SECONDS,
+        max_age = SOURCE_MAX_AGE_SECONDS,
+        max_deviation = SOURCE_MAX_DEVIATION,
+        min_sources = SOURCE_MIN_SOURCES,
+        method = SOURCE_AGGREGATION,
+        market_cfg = SOURCE_MARKET_CFG
+    )
     
+    skipped_cycles = {}
+    pulled_markets = set()
+    cycle_id = 0
     while True:
         await asyncio.sleep(SLEEPER_SECONDS_BETWEEN_REQUOTING)
+        cycle_id += 1
+        cycle_id_var.set(cycle_id)
         for market_id in [x[0] for x in all_remus_cfgs[0] if x[0] in market_config.market_maker_cfg]:
+            market_id_var.set(market_id)
             try:
                 market_cfg, market_maker_cfg = get_market_cfg(all_remus_cfgs, market_id)
 
@@ -322,9 +395,27 @@ async def async_main():
                 await claim_tokens(market_cfg, remus_contract)
 
                 # 2) Get prices
-                r = requests.get(SOURCE_DATA[market_id])
-                fair_price = float(sorted(r.json(), key = lambda x: x['T'])[-1]['p'])
-                logging.info('Fair price queried: %s.', fair_price)
+                fair = await source_manager.get_fair_price(market_id)
+                if fair is None:
+                    # Low confidence in the fair price, keep the current quotes and try again next round.
+                    # If that lasts too long, the quotes are pulled (once) as they are based on an old price.
+                    skipped_cycles[market_id] = skipped_cycles.get(market_id, 0) + 1
+                    if skipped_cycles[market_id] < MAX_SKIPPED_REQUOTING_CYCLES or market_id in pulled_markets:
+                        logging.warning(
+                            'No reliable fair price for market_id=%s, skipping requoting (%s/%s).',
+                            market_id, skipped_cycles[market_id], MAX_SKIPPED_REQUOTING_CYCLES
+                        )
+                        continue
+                    logging.error('No reliable fair price for market_id=%s, canceling its orders.', market_id)
+                    my_orders = await remus_contract.functions['get_all_user_orders'].call(user=env_config.wallet_address)
+                    to_be_canceled = [x for x in my_orders[0] if x['market_id'] == market_id]
+                    await update_delete_quotes(account, market_cfg, remus_contract, to_be_canceled, [], None, None)
+                    pulled_markets.add(market_id)
+                    continue
+                skipped_cycles[market_id] = 0
+                pulled_markets.discard(market_id)
+                fair_price = fair.price
+                logging.info('Fair price queried: %s from %s.', fair_price, fair.sources)
 
                 # 3) Get orders
                 my_orders = await remus_contract.functions['get_all_user_orders'].call(user=env_config.wallet_address)
@@ -333,8 +424,8 @@ async def async_main():
                 asks = [x for x in my_orders[0] if x['market_id'] == market_id and x['order_side'].variant == 'Ask']
                 bids = sorted(bids, key = lambda x: -x['price'])
                 asks = sorted(asks, key = lambda x: -x['price'])
-                logging.debug(f'My remaining orders queried: {bids}, {asks}.')
-                pretty_print_orders(asks, bids)
+                logging.debug('My remaining orders queried: %s, %s.', bids, asks)
+                pretty_print_orders(market_id, asks, bids)
 
                 # 4) Get position (balance of + open orders)
                 # TODO: the remus_manager is messed up, it has to be debugged and fixed
@@ -414,6 +505,7 @@ async def async_main():
                 #Claiming unclaimed
                 logging.error("Ending cancel all - claiming unclaimed.")
                 for market_id in market_config.market_maker_cfg.keys():
+                    market_id_var.set(market_id)
                     try:
                         market_cfg, market_maker_cfg = get_market_cfg(all_remus_cfgs, market_id)
                         await claim_tokens(market_cfg, remus_contract)
@@ -1,71 +1,262 @@
-from typing import Dict, List, Optional
+from dataclasses import dataclass
+from typing import Callable, Dict, List, Optional, Tuple
+import asyncio
+import statistics
+import time
 import requests
 import logging
 
 # Create a logger instance for the module
 logger = logging.getLogger(__name__)
 
+# A single trade as (timestamp in seconds, price, base quantity).
+Trade = Tuple[float, float, float]
+
+
+def parse_binance_trades(data) -> List[Trade]:
+    """Parse a Binance `aggTrades` response."""
+    return [(x["T"] / 1000, float(x["p"]), float(x["q"])) for x in data]
+
+
+def parse_bybit_trades(data) -> List[Trade]:
+    """Parse a Bybit `v5/market/recent-trade` response."""
+    return [(int(x["time"]) / 1000, float(x["price"]), float(x["size"])) for x in data["result"]["list"]]
+
+
+def parse_okx_trades(data) -> List[Trade]:
+    """Parse an OKX `v5/market/trades` response."""
+    return [(int(x["ts"]) / 1000, float(x["px"]), float(x["sz"])) for x in data["data"]]
+
+
+TRADE_PARSERS: Dict[str, Callable[[object], List[Trade]]] = {
+    "binance": parse_binance_trades,
+    "bybit": parse_bybit_trades,
+    "okx": parse_okx_trades,
+}
+
+
+@dataclass
+class SourcePrice:
+    """Latest price observed on a single venue."""
+    venue: str
+    price: float
+    timestamp: float  # time of the latest trade, in seconds
+    volume: Optional[float]  # base volume of the last max_age seconds, None if unknown
+
+
+@dataclass
+class FairPrice:
+    """Aggregated fair price together with the data it was built from."""
+    price: float
+    timestamp: float  # time of the oldest trade used, in seconds
+    sources: List[str]
+
+
 class SourceManager:
     """
     A class to manage fetching and aggregating prices from various market sources.
 
     Attributes:
-        source_data (Dict[int, str]): A dictionary mapping market IDs to their respective API URLs.
+        source_data (Dict[int, Dict[str, str]]): A dictionary mapping market IDs to {venue: API URL}.
+        timeout (float): Per-request timeout in seconds.
+        max_age (float): Sources whose latest trade is older than this (in seconds) are dropped.
+        max_deviation (float): Sources further than this relative distance from the median are dropped.
+        min_sources (int): Minimal number of sources that must survive filtering to produce a price.
+        method (str): Aggregation method, either 'median' or 'vwap'.
+        market_cfg (Dict[int, Dict[str, float]]): Per market overrides of 'max_age' and 'min_sources'.
     """
 
-    def __init__(self, source_data: Dict[int, str]) -> None:
+    def __init__(
+        self,
+        source_data: Dict[int, Dict[str, str]],
+        timeout: float = 2.0,
+        max_age: float = 60.0,
+        max_deviation: float = 0.005,
+        min_sources: int = 1,
+        method: str = "median",
+        market_cfg: Optional[Dict[int, Dict[str, float]]] = None,
+    ) -> None:
         """
-        Initialize the SourceManager with a dictionary of market IDs and their API URLs.
+        Initialize the SourceManager with a dictionary of market IDs and their venues.
 
         Args:
-            source_data (Dict[int, str]): A dictionary where keys are market IDs and values are API URLs.
+            source_data (Dict[int, Dict[str, str]]): Keys are market IDs, values map venue names
+                (see TRADE_PARSERS) to API URLs.
+            timeout (float): Per-request timeout in seconds.
+            max_age (float): Maximal allowed age of a source's latest trade, in seconds.
+            max_deviation (float): Maximal allowed relative distance of a source from the median.
+            min_sources (int): Minimal number of valid sources needed to produce a fair price.
+            method (str): 'median' or 'vwap'.
+            market_cfg (Optional[Dict[int, Dict[str, float]]]): Per market overrides of 'max_age' and
+                'min_sources', e.g. for markets whose venues trade rarely.
         """
+        if method not in ("median", "vwap"):
+            raise ValueError(f"Unknown aggregation method: {method}.")
+        for market_id, venues in source_data.items():
+            for venue in venues:
+                if venue not in TRADE_PARSERS:
+                    raise ValueError(f"Unknown venue {venue} for market_id={market_id}.")
         self.source_data = source_data
+        self.timeout = timeout
+        self.max_age = max_age
+        self.max_deviation = max_deviation
+        self.min_sources = min_sources
+        self.method = method
+        self.market_cfg = market_cfg or {}
+        # One session per market and venue, so that connections are reused across cycles while
+        # no session is shared between threads of different markets.
+        self.sessions = {
+            (market_id, venue): requests.Session()
+            for market_id, venues in source_data.items() for venue in venues
+        }
+
+    def get_max_age(self, market_id: Optional[int] = None) -> float:
+        """Maximal allowed age of a source's latest trade for a market, in seconds."""
+        return self.market_cfg.get(market_id, {}).get("max_age", self.max_age)
+
+    def get_min_sources(self, market_id: Optional[int] = None) -> int:
+        """Minimal number of valid sources needed to produce a fair price for a market."""
+        return self.market_cfg.get(market_id, {}).get("min_sources", self.min_sources)
 
-    def fetch_price(self, market_id: int) -> Optional[float]:
+    def fetch_price(self, market_id: int, venue: str) -> Optional[SourcePrice]:
         """
-        Fetch the latest price for a given market ID from the configured source.
+        Fetch the latest price for a given market ID from a single venue.
 
         Args:
             market_id (int): The ID of the market to fetch the price for.
+            venue (str): The venue to query.
 
         Returns:
-            Optional[float]: The latest price if successful, otherwise None.
+            Optional[SourcePrice]: The latest price if successful, otherwise None.
         """
-        if market_id not in self.source_data:
-            logger.error(f"No source URL configured for market_id={market_id}.")
-            return None
-
         try:
-            response = requests.get(self.source_data[market_id])
+            response = self.sessions[(market_id, venue)].get(self.source_data[market_id][venue], timeout=self.timeout)
             response.raise_for_status()
-            data = response.json()
+            trades = TRADE_PARSERS[venue](response.json())
+            if not trades:
+                logger.warning("No trades returned for market_id=%s from %s.", market_id, venue)
+                return None
 
-            latest_price = float(sorted(data, key=lambda x: x["T"])[-1]["p"])
-            logger.info(
-                f"Successfully fetched price for market_id={market_id}: {latest_price}."
-            )
-            return latest_price
+            now = time.time()
+            max_age = self.get_max_age(market_id)
+            latest = max(trades, key=lambda x: x[0])
+            # Venues return a fixed number of trades; if the oldest one is still within the window,
+            # the page was cut short and the volume would be underestimated.
+            if now - min(x[0] for x in trades) > max_age:
+                volume = sum(q for t, _, q in trades if now - t <= max_age)
+            else:
+                volume = None
+            logger.debug("Fetched price for market_id=%s from %s: %s.", market_id, venue, latest[1])
+            return SourcePrice(venue=venue, price=latest[1], timestamp=latest[0], volume=volume)
         except Exception as e:
-            logger.error(f"Failed to fetch price for market_id={market_id}: {str(e)}")
+            logger.error("Failed to fetch price for market_id=%s from %s: %s", market_id, venue, str(e))
             return None
 
-    def aggregate_price(self, prices: List[float]) -> float:
+    async def fetch_prices(self, market_id: int) -> List[SourcePrice]:
         """
-        Aggregate a list of prices into a single value (e.g., average).
+        Concurrently fetch the latest price from all venues configured for a market ID.
+
+        Venues which do not answer within `timeout` seconds in total are treated as missing. Their
+        worker thread cannot be interrupted and keeps running in the background until the request
+        itself times out, so the session it uses is replaced by a fresh one for the next cycles.
 
         Args:
-            prices (List[float]): A list of prices to aggregate.
+            market_id (int): The ID of the market to fetch the prices for.
 
         Returns:
-            float: The aggregated price (average of the list).
+            List[SourcePrice]: Prices of the venues that responded successfully.
         """
-        if not prices:
-            logger.warning("No prices provided for aggregation.")
-            return 0.0
-        return sum(prices) / len(prices)
+        if market_id not in self.source_data:
+            logger.error("No source URL configured for market_id=%s.", market_id)
+            return []
 
-    def get_fair_price(self, market_id: int) -> float:
+        tasks = {
+            asyncio.create_task(asyncio.to_thread(self.fetch_price, market_id, venue)): venue
+            for venue in self.source_data[market_id]
+        }
+        done, pending = await asyncio.wait(tasks, timeout=self.timeout)
+        for task in pending:
+            logger.warning("Source %s did not answer in time for market_id=%s.", tasks[task], market_id)
+            task.cancel()
+            self.sessions[(market_id, tasks[task])] = requests.Session()
+        return [task.result() for task in done if task.result() is not None]
+
+    def filter_prices(
+        self, prices: List[SourcePrice], now: Optional[float] = None, market_id: Optional[int] = None
+    ) -> List[SourcePrice]:
+        """
+        Drop stale sources and sources too far from the median of the fresh ones.
+
+        With only two fresh sources the median cannot tell which one is wrong, so the pair is
+        either accepted or rejected as a whole depending on its spread.
+
+        Args:
+            prices (List[SourcePrice]): Prices to filter.
+            now (Optional[float]): Current time in seconds, defaults to time.time().
+            market_id (Optional[int]): The market the prices belong to, selects its `max_age`.
+
+        Returns:
+            List[SourcePrice]: The remaining prices.
+        """
+        now = time.time() if now is None else now
+        max_age = self.get_max_age(market_id)
+        fresh = []
+        for x in prices:
+            if now - x.timestamp > max_age:
+                logger.warning("Dropping stale source %s, last trade %.1fs old.", x.venue, now - x.timestamp)
+            else:
+                fresh.append(x)
+        if len(fresh) < 2:
+            return fresh
+        if len(fresh) == 2:
+            spread = abs(fresh[0].price - fresh[1].price) / min(x.price for x in fresh)
+            if spread > self.max_deviation:
+                logger.warning(
+                    "Dropping both sources %s and %s, prices %s and %s disagree.",
+                    fresh[0].venue, fresh[1].venue, fresh[0].price, fresh[1].price
+                )
+                return []
+            return fresh
+
+        median = statistics.median(x.price for x in fresh)
+        valid = []
+        for x in fresh:
+            if abs(x.price - median) / median > self.max_deviation:
+                logger.warning("Dropping outlier source %s, price %s vs. median %s.", x.venue, x.price, median)
+            else:
+                valid.append(x)
+        return valid
+
+    def aggregate_price(self, prices: List[SourcePrice], market_id: Optional[int] = None) -> Optional[FairPrice]:
+        """
+        Aggregate a list of source prices into a single fair price.
+
+        Args:
+            prices (List[SourcePrice]): Already filtered prices to aggregate.
+            market_id (Optional[int]): The market the prices belong to, selects its `min_sources`.
+
+        Returns:
+            Optional[FairPrice]: The aggregated price (median or volume weighted), or None if there
+                are fewer than `min_sources` prices. VWAP falls back to the median if the volume of
+                any source is unknown.
+        """
+        min_sources = self.get_min_sources(market_id)
+        if len(prices) < min_sources or not prices:
+            logger.warning("Not enough prices for aggregation: %s < %s.", len(prices), min_sources)
+            return None
+
+        volumes = [x.volume for x in prices]
+        if self.method == "vwap" and None not in volumes and sum(volumes) > 0:
+            price = sum(x.price * x.volume for x in prices) / sum(volumes)
+        else:
+            price = statistics.median(x.price for x in prices)
+        return FairPrice(
+            price=price,
+            timestamp=min(x.timestamp for x in prices),
+            sources=[x.venue for x in prices],
+        )
+
+    async def get_fair_price(self, market_id: int) -> Optional[FairPrice]:
         """
         Calculate the fair price for a given market ID.
 
@@ -73,11 +264,12 @@ class SourceManager:
             market_id (int): The ID of the market to calculate the fair price for.
 
         Returns:
-            float: The calculated fair price. Returns 0.0 if the price cannot be fetched.
+            Optional[FairPrice]: The calculated fair price. Returns None if not enough fresh and
+                consistent sources are available. This is the single place where staleness is
+                enforced, callers may use the result as is.
         """
-        price = self.fetch_price(market_id)
-        if price is None:
-            logger.error(f"Unable to calculate fair price for market_id={market_id}.")
-            return 0.0
-
-        return price
\ No newline at end of file
+        prices = self.filter_prices(await self.fetch_prices(market_id), market_id=market_id)
+        fair_price = self.aggregate_price(prices, market_id=market_id)
+        if fair_price is None:
+            logger.error("Unable to calculate fair price for market_id=%s.", market_id)
+        return fair_price
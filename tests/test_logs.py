@@ -0,0 +1,152 @@
+import json
+import logging
+import queue
+import sys
+
+import pytest
+
+import logs
+from logs import (
+    ContextFilter, JsonFormatter, LazyQueueHandler, RateLimiter, cycle_id_var, market_id_var, setup_queue_logging
+)
+
+
+class ListHandler(logging.Handler):
+    def __init__(self):
+        super().__init__()
+        self.records = []
+
+    def emit(self, record):
+        self.records.append(record)
+
+
+@pytest.fixture
+def root_logger():
+    """Restores the root logger after a test replaced its handlers."""
+    root = logging.getLogger()
+    handlers, level = root.handlers[:], root.level
+    yield root
+    for handler in root.handlers[:]:
+        root.removeHandler(handler)
+    for handler in handlers:
+        root.addHandler(handler)
+    root.setLevel(level)
+
+
+def make_record(msg, args, exc_info=None):
+    return logging.LogRecord("bot", logging.INFO, __file__, 1, msg, args, exc_info)
+
+
+def test_rate_limiter(monkeypatch):
+    now = [100.0]
+    monkeypatch.setattr(logs.time, "monotonic", lambda: now[0])
+    limiter = RateLimiter(60)
+
+    assert limiter.allow(1)
+    assert not limiter.allow(1)
+    assert limiter.allow(2)
+
+    now[0] = 159.9
+    assert not limiter.allow(1)
+    now[0] = 160.0
+    assert limiter.allow(1)
+    assert not limiter.allow(1)
+
+
+def test_json_formatter_with_context():
+    market_token = market_id_var.set(3)
+    cycle_token = cycle_id_var.set(42)
+    try:
+        try:
+            raise ValueError("boom")
+        except ValueError:
+            record = make_record("Fair price %s.", (100.5,), sys.exc_info())
+        ContextFilter().filter(record)
+    finally:
+        market_id_var.reset(market_token)
+        cycle_id_var.reset(cycle_token)
+
+    entry = json.loads(JsonFormatter().format(record))
+
+    assert entry["level"] == "INFO"
+    assert entry["logger"] == "bot"
+    assert entry["market_id"] == 3
+    assert entry["cycle_id"] == 42
+    assert entry["message"] == "Fair price 100.5."
+    assert "ValueError: boom" in entry["exc_info"]
+
+
+def test_json_formatter_without_context():
+    record = make_record("hello", ())
+    ContextFilter().filter(record)
+
+    entry = json.loads(JsonFormatter().format(record))
+
+    assert entry["market_id"] is None
+    assert entry["cycle_id"] is None
+    assert "exc_info" not in entry
+
+
+def test_lazy_queue_handler_keeps_immutable_args():
+    log_queue = queue.SimpleQueue()
+    record = make_record("q: %s, p: %s, s: %s", (1, 2.5, "Ask"))
+
+    LazyQueueHandler(log_queue).handle(record)
+
+    queued = log_queue.get_nowait()
+    assert queued.args == (1, 2.5, "Ask")
+    assert queued.getMessage() == "q: 1, p: 2.5, s: Ask"
+
+
+def test_lazy_queue_handler_snapshots_mutable_args():
+    log_queue = queue.SimpleQueue()
+    orders = [1, 2]
+    record = make_record("orders %s", (orders,))
+
+    LazyQueueHandler(log_queue).handle(record)
+    orders.append(3)
+
+    queued = log_queue.get_nowait()
+    assert queued.args is None
+    assert queued.getMessage() == "orders [1, 2]"
+    assert record.args == (orders,)
+
+
+def test_setup_queue_logging_flushes_on_stop(root_logger):
+    handler = ListHandler()
+    listener = setup_queue_logging(logging.INFO, [handler])
+    orders = [1, 2]
+
+    market_token = market_id_var.set(1)
+    try:
+        for i in range(100):
+            logging.info("record %s", i)
+        logging.info("orders %s", orders)
+        logging.debug("not enabled %s", orders)
+    finally:
+        market_id_var.reset(market_token)
+    orders.append(3)
+    listener.stop()
+
+    messages = [x.getMessage() for x in handler.records]
+    assert messages == [f"record {i}" for i in range(100)] + ["orders [1, 2]"]
+    assert all(x.market_id == 1 for x in handler.records)
+
+
+def test_json_formatter_extra_fields():
+    asks = [{"maker_order_id": 7, "price": 2500.5, "amount_remaining": 0.1}]
+    logger = logging.getLogger("test_logs.extra")
+    handler = ListHandler()
+    logger.addHandler(handler)
+    logger.propagate = False
+    try:
+        logger.warning("Current orders.", extra={"asks": asks, "bids": []})
+    finally:
+        logger.removeHandler(handler)
+
+    entry = json.loads(JsonFormatter().format(handler.records[0]))
+
+    assert entry["message"] == "Current orders."
+    assert entry["asks"] == asks
+    assert entry["bids"] == []
+    assert "args" not in entry and "msg" not in entry
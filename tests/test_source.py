@@ -0,0 +1,232 @@
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import asyncio
+import json
+import threading
+import time
+
+import pytest
+
+from source import (
+    FairPrice, SourceManager, SourcePrice, parse_binance_trades, parse_bybit_trades, parse_okx_trades
+)
+
+
+def binance_payload(trades):
+    return [{"a": i, "p": str(p), "q": str(q), "T": int(t * 1000)} for i, (t, p, q) in enumerate(trades)]
+
+
+def bybit_payload(trades):
+    return {"retCode": 0, "result": {"category": "spot", "list": [
+        {"price": str(p), "size": str(q), "time": str(int(t * 1000))} for t, p, q in trades
+    ]}}
+
+
+def okx_payload(trades):
+    return {"code": "0", "data": [
+        {"px": str(p), "sz": str(q), "ts": str(int(t * 1000))} for t, p, q in trades
+    ]}
+
+
+@pytest.fixture
+def server():
+    """
+    Local HTTP stand-in for the venues. Tests fill `routes` with path -> (status, payload, delay).
+    """
+    routes = {}
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            status, payload, delay = routes[self.path]
+            time.sleep(delay)
+            body = json.dumps(payload).encode()
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    httpd = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    httpd.daemon_threads = True
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{httpd.server_address[1]}", routes
+    httpd.shutdown()
+    httpd.server_close()
+
+
+def test_parsers():
+    trades = [(1700000000.0, 100.5, 0.25), (1700000001.5, 101.0, 2.0)]
+    assert parse_binance_trades(binance_payload(trades)) == trades
+    assert parse_bybit_trades(bybit_payload(trades)) == trades
+    assert parse_okx_trades(okx_payload(trades)) == trades
+
+
+def test_unknown_venue_or_method():
+    with pytest.raises(ValueError):
+        SourceManager({1: {"kraken": "http://x"}})
+    with pytest.raises(ValueError):
+        SourceManager({1: {"binance": "http://x"}}, method="mean")
+
+
+@pytest.mark.parametrize("venue, payload", [
+    ("binance", binance_payload),
+    ("bybit", bybit_payload),
+    ("okx", okx_payload),
+])
+def test_fetch_price(server, venue, payload):
+    url, routes = server
+    now = time.time()
+    # The oldest trade is outside of the window, so the page covers it and the volume is known.
+    routes[f"/{venue}"] = (200, payload([(now - 100, 90.0, 7.0), (now - 10, 99.0, 1.0), (now - 1, 100.0, 2.0)]), 0)
+    manager = SourceManager({1: {venue: f"{url}/{venue}"}})
+
+    price = manager.fetch_price(1, venue)
+
+    assert price.venue == venue
+    assert price.price == 100.0
+    assert price.timestamp == pytest.approx(now - 1, abs=1e-3)
+    assert price.volume == 3.0
+
+
+def test_fetch_price_volume_unknown_for_short_page(server):
+    url, routes = server
+    now = time.time()
+    routes["/binance"] = (200, binance_payload([(now - 10, 99.0, 1.0), (now - 1, 100.0, 2.0)]), 0)
+    manager = SourceManager({1: {"binance": f"{url}/binance"}})
+
+    assert manager.fetch_price(1, "binance").volume is None
+
+
+def test_fetch_price_http_error(server):
+    url, routes = server
+    routes["/binance"] = (500, {}, 0)
+    manager = SourceManager({1: {"binance": f"{url}/binance"}})
+
+    assert manager.fetch_price(1, "binance") is None
+
+
+def test_fetch_prices_deadline(server):
+    url, routes = server
+    now = time.time()
+    routes["/binance"] = (200, binance_payload([(now, 100.0, 1.0)]), 0)
+    routes["/okx"] = (200, okx_payload([(now, 100.0, 1.0)]), 1.0)
+    manager = SourceManager({1: {"binance": f"{url}/binance", "okx": f"{url}/okx"}}, timeout=0.3)
+    sessions = dict(manager.sessions)
+
+    start = time.monotonic()
+    prices = asyncio.run(manager.fetch_prices(1))
+
+    assert time.monotonic() - start < 1.0
+    assert [x.venue for x in prices] == ["binance"]
+    # The late request still runs on the old session, the next fetch must not share it.
+    assert manager.sessions[(1, "binance")] is sessions[(1, "binance")]
+    assert manager.sessions[(1, "okx")] is not sessions[(1, "okx")]
+
+
+def test_sessions_not_shared_between_markets():
+    manager = SourceManager({1: {"binance": "http://x"}, 2: {"binance": "http://y"}})
+
+    assert manager.sessions[(1, "binance")] is not manager.sessions[(2, "binance")]
+
+
+def test_filter_prices_max_age_boundary():
+    manager = SourceManager({}, max_age=60)
+    now = 1000.0
+    prices = [
+        SourcePrice("binance", 100.0, now - 60, 1.0),
+        SourcePrice("bybit", 100.0, now - 60.001, 1.0),
+    ]
+
+    assert [x.venue for x in manager.filter_prices(prices, now=now)] == ["binance"]
+
+
+def test_filter_prices_drops_outlier():
+    manager = SourceManager({}, max_deviation=0.005)
+    now = 1000.0
+    prices = [
+        SourcePrice("binance", 100.0, now, 1.0),
+        SourcePrice("bybit", 100.2, now, 1.0),
+        SourcePrice("okx", 102.0, now, 1.0),
+    ]
+
+    assert [x.venue for x in manager.filter_prices(prices, now=now)] == ["binance", "bybit"]
+
+
+def test_filter_prices_two_sources():
+    manager = SourceManager({}, max_deviation=0.005)
+    now = 1000.0
+    agreeing = [SourcePrice("binance", 100.0, now, 1.0), SourcePrice("okx", 100.4, now, 1.0)]
+    disagreeing = [SourcePrice("binance", 100.0, now, 1.0), SourcePrice("okx", 102.0, now, 1.0)]
+
+    assert manager.filter_prices(agreeing, now=now) == agreeing
+    assert manager.filter_prices(disagreeing, now=now) == []
+
+
+def test_aggregate_price_median_and_vwap():
+    prices = [
+        SourcePrice("binance", 100.0, 1000.0, 3.0),
+        SourcePrice("bybit", 101.0, 999.0, 1.0),
+        SourcePrice("okx", 104.0, 998.0, 0.0),
+    ]
+
+    median = SourceManager({}, method="median").aggregate_price(prices)
+    vwap = SourceManager({}, method="vwap").aggregate_price(prices)
+
+    assert median == FairPrice(price=101.0, timestamp=998.0, sources=["binance", "bybit", "okx"])
+    assert vwap.price == pytest.approx(100.25)
+
+
+def test_aggregate_price_vwap_falls_back_to_median():
+    prices = [
+        SourcePrice("binance", 100.0, 1000.0, 3.0),
+        SourcePrice("bybit", 101.0, 1000.0, None),
+        SourcePrice("okx", 104.0, 1000.0, 1.0),
+    ]
+
+    assert SourceManager({}, method="vwap").aggregate_price(prices).price == 101.0
+
+
+def test_get_fair_price(server):
+    url, routes = server
+    now = time.time()
+    routes["/binance"] = (200, binance_payload([(now - 1, 100.0, 1.0)]), 0)
+    routes["/bybit"] = (200, bybit_payload([(now - 2, 100.2, 1.0)]), 0)
+    routes["/okx"] = (200, okx_payload([(now - 1, 100.1, 1.0)]), 0)
+    manager = SourceManager(
+        {1: {venue: f"{url}/{venue}" for venue in ["binance", "bybit", "okx"]}}, min_sources=2
+    )
+
+    fair = asyncio.run(manager.get_fair_price(1))
+
+    assert fair.price == 100.1
+    assert sorted(fair.sources) == ["binance", "bybit", "okx"]
+    assert fair.timestamp == pytest.approx(now - 2, abs=1e-3)
+
+
+def test_get_fair_price_not_enough_sources(server):
+    url, routes = server
+    now = time.time()
+    routes["/binance"] = (200, binance_payload([(now - 1, 100.0, 1.0)]), 0)
+    routes["/bybit"] = (500, {}, 0)
+    routes["/okx"] = (200, okx_payload([(now - 120, 100.1, 1.0)]), 0)
+    manager = SourceManager(
+        {1: {venue: f"{url}/{venue}" for venue in ["binance", "bybit", "okx"]}}, min_sources=2
+    )
+
+    assert asyncio.run(manager.get_fair_price(1)) is None
+
+
+def test_market_cfg_overrides():
+    manager = SourceManager(
+        {}, max_age=60, min_sources=2, market_cfg={2: {"max_age": 300, "min_sources": 1}}
+    )
+    now = 1000.0
+    prices = [SourcePrice("binance", 100.0, now - 200, 1.0)]
+
+    assert manager.filter_prices(prices, now=now, market_id=1) == []
+    assert manager.filter_prices(prices, now=now, market_id=2) == prices
+    assert manager.aggregate_price(prices, market_id=1) is None
+    assert manager.aggregate_price(prices, market_id=2).price == 100.0